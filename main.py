@@ -1,8 +1,16 @@
+import hashlib
+import io
+import json
+import os
+import time
+import threading
+import warnings
+
 import streamlit as st
 import yfinance as yf
+import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
 st.set_page_config(page_title="Simplified Market Dashboard", layout="wide")
 
@@ -38,101 +46,279 @@ TICKER_NAMES = {
     'SOL-USD': 'Solana'
 }
 
+# Display-name columns of each class, in class order
+CLASS_COLUMNS = {cls: [TICKER_NAMES.get(t, t) for t in tickers] for cls, tickers in ASSET_CLASSES.items()}
+
 # Available periods for selection
 PERIODS = ['1mo', '3mo', '6mo', '1y', '2y', '5y', '10y', 'max']
 
-def fetch_data(tickers, period='1y'):
-    if not tickers:
-        return pd.DataFrame()
-    
-    raw_data = yf.download(tickers, period=period, progress=False)
+# Downloaded prices are kept in memory and on disk (as Arrow-backed parquet) for an hour
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+CACHE_TTL = 3600
+
+# Downloads with missing tickers (delisted, throttled) are only kept briefly
+# in memory, so they are retried soon without refetching on every rerun
+PARTIAL_TTL = 60
+
+def _cache_path(tickers, period):
+    key = hashlib.md5(repr((tickers, period)).encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, key)
+
+def _disk_cache_timestamp(tickers, period):
+    # When the disk entry was written, or None if it is missing or stale
+    try:
+        with open(_cache_path(tickers, period) + '.json') as f:
+            timestamp = json.load(f)['timestamp']
+        if time.time() - timestamp > CACHE_TTL:
+            return None
+        return timestamp
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def _read_disk_cache(tickers, period):
+    try:
+        return pd.read_parquet(_cache_path(tickers, period) + '.parquet',
+                               engine='pyarrow', use_threads=True, memory_map=True)
+    except (OSError, ValueError, ImportError):
+        # Unreadable entries just fall through to Yahoo
+        return None
+
+def _write_disk_cache(tickers, period, data):
+    path = _cache_path(tickers, period)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        data.to_parquet(path + '.parquet', engine='pyarrow', compression='snappy')
+        # Sidecar is written last so a half-written parquet is never picked up
+        with open(path + '.json', 'w') as f:
+            json.dump({'tickers': list(tickers), 'period': period, 'timestamp': time.time()}, f)
+    except (OSError, ValueError, ImportError):
+        pass
+
+def _download_prices(tickers, period):
+    # auto_adjust folds splits and dividends into 'Close', so there is no
+    # separate 'Adj Close' column to look for
+    raw_data = yf.download(list(tickers), period=period, progress=False, auto_adjust=True, threads=True)
     
     if raw_data.empty:
         return pd.DataFrame()
     
-    # Handle single vs multiple tickers
-    if len(tickers) == 1:
-        # For single ticker, raw_data is a simple DataFrame
-        if isinstance(raw_data.columns, pd.MultiIndex):
-            # Sometimes even single ticker returns MultiIndex
-            if 'Adj Close' in raw_data.columns.get_level_values(0):
-                data = raw_data['Adj Close']
-            else:
-                data = raw_data['Close']
-            if isinstance(data, pd.Series):
-                data = data.to_frame(name=tickers[0])
-        else:
-            # Simple columns
-            if 'Adj Close' in raw_data.columns:
-                data = raw_data[['Adj Close']].copy()
-                data.columns = [tickers[0]]
-            elif 'Close' in raw_data.columns:
-                data = raw_data[['Close']].copy()
-                data.columns = [tickers[0]]
-            else:
-                # Fallback: use the entire dataframe
-                data = raw_data.copy()
-    else:
-        # Multiple tickers - MultiIndex columns
-        if isinstance(raw_data.columns, pd.MultiIndex):
-            if 'Adj Close' in raw_data.columns.get_level_values(0):
-                data = raw_data['Adj Close']
-            else:
-                data = raw_data['Close']
-        else:
-            # Shouldn't happen with multiple tickers, but handle it
-            data = raw_data.copy()
+    data = raw_data['Close']
+    # A single ticker can come back with flat columns, giving a Series here
+    if isinstance(data, pd.Series):
+        data = data.to_frame(name=tickers[0])
+    return data
+
+class MarketDataError(Exception):
+    pass
+
+class PartialDownload(Exception):
+    # Carries a download with missing tickers past the long-lived cache, which
+    # does not cache exceptions; the download itself is kept for PARTIAL_TTL
+    def __init__(self, data):
+        super().__init__("Some tickers came back without data")
+        self.data = data
+
+@st.cache_data(ttl=PARTIAL_TTL, show_spinner=False)
+def _download_recent(tickers, period):
+    data = _download_prices(tickers, period)
+    # Single precision is plenty for prices and yields and halves the memory
+    # held by the caches and pushed through the correlation
+    data = data.dropna(how='all').astype(np.float32)
+    if data.empty:
+        raise MarketDataError(f"No data returned for {', '.join(tickers)}")
+    return data
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=32, show_spinner=False)
+def _fetch_cached(tickers, period, disk_timestamp):
+    # disk_timestamp is part of the cache key: once the disk entry goes stale
+    # fetch_data stops asking for it, so a parquet file loaded late in its
+    # life is not held in memory for another full CACHE_TTL
+    if disk_timestamp is not None:
+        cached = _read_disk_cache(tickers, period)
+        if cached is not None:
+            return cached
+    
+    data = _download_recent(tickers, period)
+    if data.reindex(columns=list(tickers)).isna().all().any():
+        # Only _download_recent keeps a download with missing tickers, and
+        # nothing is written to disk
+        raise PartialDownload(data)
     
-    data = data.dropna(how='all')
+    _write_disk_cache(tickers, period, data)
     return data
 
+def fetch_data(tickers, period='1y'):
+    # tickers must be a tuple so Streamlit can hash it as the cache key.
+    # Raises MarketDataError when Yahoo returns nothing at all
+    if not tickers:
+        return pd.DataFrame()
+    try:
+        return _fetch_cached(tickers, period, _disk_cache_timestamp(tickers, period))
+    except PartialDownload as partial:
+        return partial.data
+
+def select_columns(data, columns):
+    # Slice the batched download down to the requested columns, skipping fetch misses;
+    # rows that only other classes traded on (weekends, holidays) are dropped
+    return data.reindex(columns=pd.Index(columns).intersection(data.columns)).dropna(how='all')
+
+def class_columns(cls, selected_tickers):
+    selected = set(selected_tickers)
+    return [name for ticker, name in zip(ASSET_CLASSES[cls], CLASS_COLUMNS[cls]) if ticker in selected]
+
 def normalize_data(data):
     # Normalize to start at 100 for better scale comparison
-    normalized = pd.DataFrame()
-    for col in data.columns:
-        first_valid = data[col].first_valid_index()
-        if first_valid is not None:
-            first_value = data.loc[first_valid, col]
-            if first_value != 0:
-                normalized[col] = (data[col] / first_value) * 100
-            else:
-                normalized[col] = data[col]
-        else:
-            normalized[col] = data[col]
-    return normalized
+    arr = data.to_numpy(dtype=np.float32, copy=False)
+    # One columnar pass over the NaN mask gives every column's first valid
+    # row; argmax lands on row 0 for all-NaN columns, which the gathered
+    # mask value then flags
+    valid = ~np.isnan(arr)
+    cols = np.arange(arr.shape[1])
+    first_idx = valid.argmax(axis=0)
+    first_vals = arr[first_idx, cols]
+    # Columns that are all NaN or start at 0 are left as they are
+    usable = valid[first_idx, cols] & (first_vals != 0)
+    out = np.where(usable, arr / np.where(usable, first_vals, 1.0) * 100, arr)
+    return pd.DataFrame(out, index=data.index, columns=data.columns)
 
 def scale_to_fit(data):
     # Scale each series to 0-100 based on its min and max
-    scaled = pd.DataFrame()
-    for col in data.columns:
-        col_data = data[col].dropna()
-        if len(col_data) > 0:
-            data_min = col_data.min()
-            data_max = col_data.max()
-            data_range = data_max - data_min
-            if data_range != 0:
-                scaled[col] = 100 * (data[col] - data_min) / data_range
-            else:
-                scaled[col] = data[col]
-        else:
-            scaled[col] = data[col]
-    return scaled
+    arr = data.to_numpy(dtype=np.float32, copy=False)
+    with warnings.catch_warnings():
+        # All-NaN columns give NaN bounds and are passed through below
+        warnings.simplefilter('ignore', RuntimeWarning)
+        data_min = np.nanmin(arr, axis=0)
+        data_max = np.nanmax(arr, axis=0)
+    data_range = data_max - data_min
+    usable = ~np.isnan(data_range) & (data_range != 0)
+    out = np.where(usable, 100 * (arr - data_min) / np.where(usable, data_range, 1.0), arr)
+    return pd.DataFrame(out, index=data.index, columns=data.columns)
 
 def compute_returns(data):
-    returns = data.pct_change().dropna()
-    return returns
+    # Same as pct_change().dropna(): gaps are padded forward, then any row
+    # that still has a NaN (leading history) is dropped
+    arr = data.ffill().to_numpy(dtype=np.float32, copy=False)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = arr[1:] / arr[:-1] - 1.0
+    complete = ~np.isnan(returns).any(axis=1)
+    return pd.DataFrame(returns[complete], index=data.index[1:][complete], columns=data.columns)
 
-def plot_heatmap(corr_matrix, title):
-    num_assets = len(corr_matrix)
+def fast_corr(returns):
+    # np.corrcoef on the raw array skips pandas' pairwise-NaN handling;
+    # compute_returns already drops rows with NaNs
+    arr = returns.to_numpy(dtype=np.float32, copy=False)
+    cm = np.corrcoef(arr, rowvar=False, dtype=np.float32)
+    return pd.DataFrame(cm, index=returns.columns, columns=returns.columns)
+
+@st.cache_resource
+def _heatmap_figure(num_assets):
+    # One reusable figure per matrix size, shared across reruns and sessions;
+    # the lock keeps concurrent sessions from drawing on it at the same time
     fig_size = (max(8, num_assets * 0.5), max(6, num_assets * 0.5))
-    fig, ax = plt.subplots(figsize=fig_size)
-    sns.heatmap(corr_matrix, annot=True, cmap='coolwarm', ax=ax, fmt=".2f", 
-                annot_kws={"size": 8}, vmin=-1, vmax=1)
-    ax.set_title(title)
-    plt.xticks(rotation=45, ha='right')
-    plt.yticks(rotation=0)
-    plt.tight_layout()
-    st.pyplot(fig)
+    return Figure(figsize=fig_size), threading.Lock()
+
+# Bounded so the PNG cache cannot grow for the lifetime of the server
+@st.cache_data(ttl=CACHE_TTL, max_entries=64, show_spinner=False)
+def _render_heatmap_png(values_bytes, labels, title):
+    # Keyed on the raw matrix bytes, so an unchanged matrix skips matplotlib
+    values = np.frombuffer(values_bytes, dtype=np.float32).reshape(len(labels), len(labels))
+    fig, lock = _heatmap_figure(len(labels))
+    with lock:
+        # Clear the whole figure so the previous colorbar axes go too
+        fig.clf()
+        ax = fig.add_subplot()
+        # The matrix is symmetric, so only the lower triangle and diagonal are drawn
+        mask = np.triu(np.ones_like(values, dtype=bool), k=1)
+        im = ax.imshow(np.ma.masked_array(values, mask=mask), cmap='coolwarm', vmin=-1, vmax=1)
+        for i, j in zip(*np.nonzero(~mask)):
+            # Dark text on the pale middle of the colormap, white on the ends
+            color = 'white' if abs(values[i, j]) > 0.6 else 'black'
+            ax.text(j, i, f"{values[i, j]:.2f}", ha='center', va='center', fontsize=8, color=color)
+        ax.set_xticks(range(len(labels)))
+        ax.set_xticklabels(labels, rotation=45, ha='right')
+        ax.set_yticks(range(len(labels)))
+        ax.set_yticklabels(labels)
+        for spine in ax.spines.values():
+            spine.set_visible(False)
+        fig.colorbar(im, ax=ax)
+        ax.set_title(title)
+        fig.tight_layout()
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png', dpi=200, bbox_inches='tight')
+    return buf.getvalue()
+
+def plot_heatmap(corr_matrix, title):
+    values = corr_matrix.to_numpy(dtype=np.float32)
+    st.image(_render_heatmap_png(values.tobytes(), tuple(corr_matrix.columns), title))
+
+@st.fragment
+def render_class_tab(cls, market_data, normalize, scale_fit):
+    # Runs as a fragment so changing this tab's ticker selection only reruns
+    # this tab, reusing the data passed in by the last full run
+    st.header(cls)
+    
+    # Ticker selection for this class
+    class_tickers = ASSET_CLASSES[cls]
+    
+    # Default selection
+    if cls not in st.session_state.ticker_selections:
+        st.session_state.ticker_selections[cls] = class_tickers
+    
+    selected_tickers = st.multiselect(
+        f"Select {cls} tickers to display",
+        options=class_tickers,
+        default=st.session_state.ticker_selections[cls],
+        format_func=lambda x: TICKER_NAMES.get(x, x),
+        key=f"select_{cls}"
+    )
+    
+    # Update session state
+    st.session_state.ticker_selections[cls] = selected_tickers
+    
+    if not selected_tickers:
+        st.warning(f"Please select at least one ticker for {cls}.")
+        return
+    
+    original_data = select_columns(market_data, class_columns(cls, selected_tickers))
+    
+    if not original_data.empty:
+        # Apply transformations; both return new frames, so no copy is needed
+        data = original_data
+        if normalize:
+            data = normalize_data(data)
+        if scale_fit:
+            data = scale_to_fit(data)
+        
+        # Price Chart
+        st.subheader("Price/Yields Chart")
+        st.line_chart(data, use_container_width=True, height=500)
+        
+        # Statistics
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Data Points", len(original_data))
+        with col2:
+            if len(original_data) > 1:
+                latest = original_data.iloc[-1]
+                previous = original_data.iloc[-2]
+                change = ((latest - previous) / previous * 100).mean()
+                st.metric("Avg Last Change", f"{change:.2f}%")
+        with col3:
+            st.metric("Tickers Selected", len(selected_tickers))
+        
+        # Correlation Heatmap
+        if len(selected_tickers) > 1:
+            st.subheader("Correlation Heatmap (Daily Returns)")
+            returns = compute_returns(original_data)
+            if not returns.empty and len(returns.columns) > 1:
+                corr_matrix = fast_corr(returns)
+                plot_heatmap(corr_matrix, f"{cls} Correlation")
+            else:
+                st.warning("Insufficient data for correlation heatmap.")
+        else:
+            st.info("Select at least 2 tickers to view correlation heatmap.")
+    else:
+        st.error(f"No data available for {cls}.")
 
 def main():
     st.title("Simplified Market Dashboard")
@@ -168,30 +354,40 @@ def main():
     tab_names = ["All Assets"] + selected_classes
     tabs = st.tabs(tab_names)
     
+    # Fetch every ticker of the selected classes in one request; tabs slice from it
+    class_universe = [t for cls in selected_classes for t in ASSET_CLASSES[cls]]
+    with st.spinner("Fetching market data..."):
+        try:
+            market_data = fetch_data(tuple(sorted(set(class_universe))), period=selected_period)
+        except MarketDataError:
+            # Tabs report the missing data; nothing is cached, so the next rerun retries
+            market_data = pd.DataFrame()
+    # Rename columns to human-readable names once for all tabs
+    market_data = market_data.rename(columns=TICKER_NAMES)
+    
     # All Assets tab
     with tabs[0]:
         st.header("All Assets")
         
-        # Collect all selected tickers from individual class selections
+        # Collect all selected tickers, and their display columns, from individual class selections
         all_selected_tickers = []
+        all_selected_columns = []
         for cls in selected_classes:
             if cls in st.session_state.ticker_selections:
-                all_selected_tickers.extend(st.session_state.ticker_selections[cls])
+                class_selection = st.session_state.ticker_selections[cls]
             else:
-                all_selected_tickers.extend(ASSET_CLASSES[cls])
+                class_selection = ASSET_CLASSES[cls]
+            all_selected_tickers.extend(class_selection)
+            all_selected_columns.extend(class_columns(cls, class_selection))
         
-        all_selected_tickers = list(set(all_selected_tickers))
+        all_selected_tickers = list(dict.fromkeys(all_selected_tickers))
         
         if all_selected_tickers:
-            with st.spinner("Fetching market data..."):
-                original_data = fetch_data(all_selected_tickers, period=selected_period)
+            original_data = select_columns(market_data, list(dict.fromkeys(all_selected_columns)))
             
             if not original_data.empty:
-                # Rename columns to human-readable names
-                original_data.columns = [TICKER_NAMES.get(col, col) for col in original_data.columns]
-                
-                # Apply transformations
-                data = original_data.copy()
+                # Apply transformations; both return new frames, so no copy is needed
+                data = original_data
                 if normalize:
                     data = normalize_data(data)
                 if scale_fit:
@@ -206,7 +402,7 @@ def main():
                     st.subheader("Correlation Heatmap (Daily Returns)")
                     returns = compute_returns(original_data)
                     if not returns.empty and len(returns.columns) > 1:
-                        corr_matrix = returns.corr()
+                        corr_matrix = fast_corr(returns)
                         plot_heatmap(corr_matrix, "All Assets Correlation")
                     else:
                         st.warning("Insufficient data for correlation heatmap.")
@@ -218,80 +414,9 @@ def main():
             st.warning("No tickers selected. Please select tickers in individual asset class tabs.")
     
     # Individual class tabs
-    tab_index = 1
-    for cls in selected_classes:
-        with tabs[tab_index]:
-            st.header(cls)
-            
-            # Ticker selection for this class
-            class_tickers = ASSET_CLASSES[cls]
-            
-            # Default selection
-            if cls not in st.session_state.ticker_selections:
-                st.session_state.ticker_selections[cls] = class_tickers
-            
-            selected_tickers = st.multiselect(
-                f"Select {cls} tickers to display",
-                options=class_tickers,
-                default=st.session_state.ticker_selections[cls],
-                format_func=lambda x: TICKER_NAMES.get(x, x),
-                key=f"select_{cls}"
-            )
-            
-            # Update session state
-            st.session_state.ticker_selections[cls] = selected_tickers
-            
-            if not selected_tickers:
-                st.warning(f"Please select at least one ticker for {cls}.")
-                tab_index += 1
-                continue
-            
-            with st.spinner(f"Fetching {cls} data..."):
-                original_data = fetch_data(selected_tickers, period=selected_period)
-            
-            if not original_data.empty:
-                # Rename columns to human-readable names
-                original_data.columns = [TICKER_NAMES.get(col, col) for col in original_data.columns]
-                
-                # Apply transformations
-                data = original_data.copy()
-                if normalize:
-                    data = normalize_data(data)
-                if scale_fit:
-                    data = scale_to_fit(data)
-                
-                # Price Chart
-                st.subheader("Price/Yields Chart")
-                st.line_chart(data, use_container_width=True, height=500)
-                
-                # Statistics
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Data Points", len(original_data))
-                with col2:
-                    if len(original_data) > 1:
-                        latest = original_data.iloc[-1]
-                        previous = original_data.iloc[-2]
-                        change = ((latest - previous) / previous * 100).mean()
-                        st.metric("Avg Last Change", f"{change:.2f}%")
-                with col3:
-                    st.metric("Tickers Selected", len(selected_tickers))
-                
-                # Correlation Heatmap
-                if len(selected_tickers) > 1:
-                    st.subheader("Correlation Heatmap (Daily Returns)")
-                    returns = compute_returns(original_data)
-                    if not returns.empty and len(returns.columns) > 1:
-                        corr_matrix = returns.corr()
-                        plot_heatmap(corr_matrix, f"{cls} Correlation")
-                    else:
-                        st.warning("Insufficient data for correlation heatmap.")
-                else:
-                    st.info("Select at least 2 tickers to view correlation heatmap.")
-            else:
-                st.error(f"No data available for {cls}.")
-        
-        tab_index += 1
+    for tab, cls in zip(tabs[1:], selected_classes):
+        with tab:
+            render_class_tab(cls, market_data, normalize, scale_fit)
 
 if __name__ == "__main__":
     main()